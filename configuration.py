@@ -5,8 +5,7 @@ APP_VERSION = "1.1.2"
 
 # Ensure data directory exists
 data_dir = "data"
-if not os.path.exists(data_dir):
-    os.makedirs(data_dir)
+os.makedirs(data_dir, exist_ok=True)
 
 # Store database in the data directory for persistence
 GAMES_DB = os.path.join(data_dir, "games.db")
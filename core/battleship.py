@@ -37,6 +37,12 @@ def rc_to_cell(row, col):
     return f"{COLS[col]}{row + 1}"
 
 
+# every cell name, row by row, built once instead of on each board render
+GRID = tuple(
+    tuple(rc_to_cell(row, col) for col in range(BOARD_SIZE)) for row in range(BOARD_SIZE)
+)
+
+
 def fleet_cells(ships):
     return {cell for ship in ships for cell in ship}
 
@@ -15,10 +15,6 @@ class BattleshipManager(GameManager):
     def status_after_join(self):
         return "placing"
 
-    @staticmethod
-    def opponent(side):
-        return "B" if side == "A" else "A"
-
     # ==================== Lifecycle ====================
 
     def create_battleship_game(self):
@@ -31,82 +27,115 @@ class BattleshipManager(GameManager):
         game["players"] = self.get_players(game_id)
         return game
 
+    @staticmethod
+    def find_player(game, player_token):
+        # looked up among the players get_battleship_game() already loaded,
+        # so callers need no second get_player() query
+        return next((p for p in game["players"] if p["player_token"] == player_token), None)
+
     # ==================== Placement ====================
 
     def submit_fleet(self, game_id, player_token, ships):
-        game = self.get_battleship_game(game_id)
-        if not game:
-            return {"success": False, "error": "Game not found"}
-        if game["status"] not in ("waiting", "placing"):
-            return {"success": False, "error": "Placement is not available right now"}
-
-        player = self.get_player(player_token)
-        if not player or player["game_id"] != game_id:
-            return {"success": False, "error": "Player not found in this game"}
-
-        ok, error = battleship.validate_fleet(ships)
-        if not ok:
-            return {"success": False, "error": error}
-
-        state = player["state"]
-        state["fleet"] = ships
-        self.update_player_state(player_token, state, ready=True)
-
-        players = self.get_players(game_id)
-        if len(players) == 2 and all(p["ready"] for p in players):
-            self.set_status(game_id, "playing", winner=None, result_reason=None)
-            self.set_turn(game_id, self.first_side)
+        # The status check and the player read share the writes' BEGIN
+        # IMMEDIATE, so a fleet can't be stored into a game that has started
+        # or finished in between. Once both players are ready the game starts
+        # in the same commit.
+        with self._transaction() as cursor:
+            game = self.get_battleship_game(game_id)
+            if not game:
+                return {"success": False, "error": "Game not found"}
+            if game["status"] not in ("waiting", "placing"):
+                return {"success": False, "error": "Placement is not available right now"}
+
+            player = self.find_player(game, player_token)
+            if not player:
+                return {"success": False, "error": "Player not found in this game"}
+
+            ok, error = battleship.validate_fleet(ships)
+            if not ok:
+                return {"success": False, "error": error}
+
+            state = player["state"]
+            state["fleet"] = ships
+
+            cursor.execute(
+                "UPDATE match_players SET state = ?, ready = 1 WHERE player_token = ?",
+                (self._dumps(state), player_token),
+            )
+            cursor.execute(
+                "UPDATE match_sessions SET status = 'playing', turn_side = ?, winner = NULL, "
+                "result_reason = NULL WHERE game_id = ? "
+                "AND (SELECT COUNT(*) FROM match_players WHERE game_id = ? AND ready = 1) = 2",
+                (self.first_side, game_id, game_id),
+            )
 
         return {"success": True}
 
     # ==================== Shooting ====================
 
     def make_shot(self, game_id, player_token, cell):
-        game = self.get_battleship_game(game_id)
-        if not game:
-            return {"success": False, "error": "Game not found"}
-        if game["status"] != "playing":
-            return {"success": False, "error": "Game is not in progress"}
-
-        player = self.get_player(player_token)
-        if not player or player["game_id"] != game_id:
-            return {"success": False, "error": "Player not found in this game"}
-        if game["turn_side"] != player["side"]:
-            return {"success": False, "error": "Not your turn"}
-
-        my_side = player["side"]
-        opp_side = self.opponent(my_side)
-        opponent = next((p for p in game["players"] if p["side"] == opp_side), None)
-        if not opponent:
-            return {"success": False, "error": "Opponent not found"}
-
-        opp_state = opponent["state"]
-        shots_received = opp_state.setdefault("shots_received", {})
-        outcome = battleship.apply_shot(opp_state.get("fleet", []), shots_received, cell)
-        if outcome.get("error"):
-            return {"success": False, "error": outcome["error"]}
-
-        my_state = player["state"]
-        my_state.setdefault("shots_made", {})[cell.strip().upper()] = outcome["result"]
-
-        self.update_player_state(opponent["player_token"], opp_state)
-        self.update_player_state(player_token, my_state)
-        self.increment_move_count(game_id)
-        self.add_event(
-            game_id,
-            my_side,
-            "shot",
-            {
-                "cell": cell.strip().upper(),
-                "result": outcome["result"],
-                "sunk": outcome["sunk"],
-            },
-        )
-
-        if outcome["ships_left"] == 0:
-            self.set_status(game_id, "finished", winner=my_side, result_reason="all_sunk")
-        elif outcome["result"] == "miss":
-            self.set_turn(game_id, opp_side)
+        # The reads share the write's BEGIN IMMEDIATE, so the turn check and
+        # both boards can't go stale before the shot is stored.
+        with self._transaction() as cursor:
+            game = self.get_battleship_game(game_id)
+            if not game:
+                return {"success": False, "error": "Game not found"}
+            if game["status"] != "playing":
+                return {"success": False, "error": "Game is not in progress"}
+
+            player = self.find_player(game, player_token)
+            if not player:
+                return {"success": False, "error": "Player not found in this game"}
+            if game["turn_side"] != player["side"]:
+                return {"success": False, "error": "Not your turn"}
+
+            my_side = player["side"]
+            opp_side = self.opponent(my_side)
+            opponent = next((p for p in game["players"] if p["side"] == opp_side), None)
+            if not opponent:
+                return {"success": False, "error": "Opponent not found"}
+
+            cell = cell.strip().upper()
+            opp_state = opponent["state"]
+            shots_received = opp_state.setdefault("shots_received", {})
+            outcome = battleship.apply_shot(opp_state.get("fleet", []), shots_received, cell)
+            if outcome.get("error"):
+                return {"success": False, "error": outcome["error"]}
+
+            my_state = player["state"]
+            my_state.setdefault("shots_made", {})[cell] = outcome["result"]
+
+            if outcome["ships_left"] == 0:
+                status, winner, result_reason, turn_side = "finished", my_side, "all_sunk", my_side
+            elif outcome["result"] == "miss":
+                status, winner, result_reason, turn_side = "playing", None, None, opp_side
+            else:
+                status, winner, result_reason, turn_side = "playing", None, None, my_side
+
+            # both boards, the session row and the event in one commit
+            cursor.executemany(
+                "UPDATE match_players SET state = ? WHERE player_token = ?",
+                [
+                    (self._dumps(opp_state), opponent["player_token"]),
+                    (self._dumps(my_state), player_token),
+                ],
+            )
+            cursor.execute(
+                "UPDATE match_sessions SET status = ?, winner = ?, result_reason = ?, "
+                "turn_side = ?, move_count = move_count + 1 WHERE game_id = ?",
+                (status, winner, result_reason, turn_side, game_id),
+            )
+            self._insert_event(
+                cursor,
+                game_id,
+                my_side,
+                "shot",
+                {
+                    "cell": cell,
+                    "result": outcome["result"],
+                    "sunk": outcome["sunk"],
+                },
+            )
 
         return {
             "success": True,
@@ -122,11 +151,20 @@ class BattleshipManager(GameManager):
         if game["status"] != "playing":
             return {"success": False, "error": "Game is not in progress"}
 
-        player = self.get_player(player_token)
-        if not player or player["game_id"] != game_id:
+        player = self.find_player(game, player_token)
+        if not player:
             return {"success": False, "error": "Player not found in this game"}
 
         winner = self.opponent(player["side"])
-        self.set_status(game_id, "finished", winner=winner, result_reason="resign")
-        self.add_event(game_id, player["side"], "resign", {"winner": winner})
+        # status and event land in one commit; the status guard keeps a shot
+        # that just won the game from being overwritten by the resignation
+        with self._transaction() as cursor:
+            cursor.execute(
+                "UPDATE match_sessions SET status = 'finished', winner = ?, "
+                "result_reason = 'resign' WHERE game_id = ? AND status = 'playing'",
+                (winner, game_id),
+            )
+            if not cursor.rowcount:
+                return {"success": False, "error": "Game is not in progress"}
+            self._insert_event(cursor, game_id, player["side"], "resign", {"winner": winner})
         return {"success": True, "winner": winner, "result_reason": "resign"}
@@ -19,14 +19,63 @@ import random
 import secrets
 import string
 import sqlite3
+import threading
+from contextlib import contextmanager
 
 from configuration import GAMES_DB
 
 DEFAULT_EXPIRY_HOURS = 24
-
-
-def make_game_id(length=8):
-    return "".join(random.choices(string.ascii_lowercase + string.digits, k=length))
+GAME_ID_LENGTH = 8
+# Game ids are public (they are the spectator link), so they only need to
+# be unique, not unguessable; the tokens that grant moves use secrets.
+GAME_ID_ALPHABET = string.ascii_lowercase + string.digits
+CREATE_ATTEMPTS = 5
+
+# sqlite3 keeps a per-connection cache of compiled statements; size it so
+# every query the managers issue stays compiled.
+STATEMENT_CACHE_SIZE = 256
+
+# Applied to the shared connection once, when it is opened. With WAL a
+# NORMAL sync is still crash-safe, it just skips the fsync on every commit,
+# and readers in other processes (a second worker, the sqlite3 shell) are
+# not blocked while a write is in progress. Within this process all access
+# is serialized by the connection's lock anyway. Reads go
+# through a memory map of the file rather than a read() per page. With
+# foreign keys on, deleting a session cascades to its players, join
+# tokens and events.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+)
+
+# Hot read queries, shared as constants so every call passes the very same
+# SQL text and hits the statement cache.
+SQL_SELECT_SESSION = (
+    "SELECT game_id, game_type, status, turn_side, state, move_count, created_at, "
+    "expires_at, winner, result_reason FROM match_sessions WHERE game_id = ?"
+)
+SQL_SELECT_PLAYERS = (
+    "SELECT player_token, game_id, side, state, ready, created_at "
+    "FROM match_players WHERE game_id = ? ORDER BY created_at"
+)
+SQL_SELECT_PLAYER = (
+    "SELECT player_token, game_id, side, state, ready, created_at "
+    "FROM match_players WHERE player_token = ?"
+)
+SQL_SELECT_GAME_PLAYER = SQL_SELECT_PLAYER + " AND game_id = ?"
+SQL_SELECT_EVENTS = (
+    "SELECT id, game_id, side, event_type, data, timestamp "
+    "FROM match_events WHERE game_id = ? ORDER BY id"
+)
+
+
+def make_game_id(length=GAME_ID_LENGTH):
+    return "".join(random.choices(GAME_ID_ALPHABET, k=length))
 
 
 def make_token(length=32):
@@ -40,8 +89,21 @@ class GameManager:
     sides = ("A", "B")
     expiry_hours = DEFAULT_EXPIRY_HOURS
 
+    # db_path -> (connection, lock), shared by every manager on that file
+    _connections = {}
+    _connections_lock = threading.Lock()
+
     def __init__(self, db_path=GAMES_DB):
         self.db_path = db_path
+        # One long-lived connection per database file instead of a
+        # connect/close per query. The chess and battleship managers use the
+        # same file, so they share it (and its page cache) rather than
+        # opening two and waiting on each other's write locks. It is used
+        # from several threads, so every use holds the lock.
+        with GameManager._connections_lock:
+            if db_path not in GameManager._connections:
+                GameManager._connections[db_path] = (self._connect(), threading.RLock())
+            self._conn, self._lock = GameManager._connections[db_path]
         self.init_db()
 
     @property
@@ -52,6 +114,9 @@ class GameManager:
     def second_side(self):
         return self.sides[1]
 
+    def opponent(self, side):
+        return self.sides[1] if side == self.sides[0] else self.sides[0]
+
     # a game moves to this status as soon as the second player joins
     @property
     def status_after_join(self):
@@ -59,10 +124,42 @@ class GameManager:
 
     # ==================== DB init ====================
 
+    def _connect(self):
+        # isolation_level=None: single statements autocommit, multi-statement
+        # writes go through _transaction() with an explicit BEGIN/COMMIT
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def _cursor(self):
+        with self._lock:
+            yield self._conn.cursor()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
     def init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # the whole schema goes in one transaction, subclasses add to it
+        with self._transaction() as cursor:
+            self.create_schema(cursor)
 
+    def create_schema(self, cursor):
         cursor.execute(
             """
             CREATE TABLE IF NOT EXISTS match_sessions (
@@ -79,6 +176,11 @@ class GameManager:
             )
             """
         )
+        # the periodic expiry sweep is a range scan on expires_at
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_match_sessions_expires "
+            "ON match_sessions(expires_at)"
+        )
 
         cursor.execute(
             """
@@ -93,6 +195,11 @@ class GameManager:
             )
             """
         )
+        # players are looked up by game on every page render, in join order
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_match_players_game "
+            "ON match_players(game_id, created_at)"
+        )
 
         cursor.execute(
             """
@@ -105,6 +212,12 @@ class GameManager:
             )
             """
         )
+        # the waiting page looks up the open invite by game, and the
+        # ON DELETE CASCADE from match_sessions needs game_id indexed too
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_match_join_tokens_game "
+            "ON match_join_tokens(game_id, used)"
+        )
 
         cursor.execute(
             """
@@ -119,9 +232,11 @@ class GameManager:
             )
             """
         )
-
-        conn.commit()
-        conn.close()
+        # every game page reads its move/shot history, in insertion order
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_match_events_game "
+            "ON match_events(game_id, id)"
+        )
 
     # ==================== JSON state helpers ====================
 
@@ -144,46 +259,40 @@ class GameManager:
     # ==================== Lifecycle ====================
 
     def create_session(self, player_state=None):
-        game_id = make_game_id()
-        creator_token = make_token()
-        join_token = make_token()
-
         now = datetime.datetime.utcnow()
         expires_at = now + datetime.timedelta(hours=self.expiry_hours)
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        try:
-            cursor.execute(
-                "INSERT INTO match_sessions (game_id, game_type, status, state, expires_at) "
-                "VALUES (?, ?, 'waiting', ?, ?)",
-                (game_id, self.game_type, self._dumps(self.initial_state()), expires_at.isoformat()),
-            )
-            cursor.execute(
-                "INSERT INTO match_players (player_token, game_id, side, state) VALUES (?, ?, ?, ?)",
-                (creator_token, game_id, self.first_side, self._dumps(player_state or {})),
-            )
-            cursor.execute(
-                "INSERT INTO match_join_tokens (join_token, game_id) VALUES (?, ?)",
-                (join_token, game_id),
-            )
-            conn.commit()
-        except sqlite3.IntegrityError:
-            conn.close()
-            return self.create_session(player_state)
-        conn.close()
-        return game_id, creator_token, join_token
+        # An id collision is retried with a one character longer id; after
+        # CREATE_ATTEMPTS collisions in a row something else is wrong.
+        for attempt in range(CREATE_ATTEMPTS):
+            game_id = make_game_id(GAME_ID_LENGTH + attempt)
+            creator_token = make_token()
+            join_token = make_token()
+            try:
+                with self._transaction() as cursor:
+                    cursor.execute(
+                        "INSERT INTO match_sessions (game_id, game_type, status, state, expires_at) "
+                        "VALUES (?, ?, 'waiting', ?, ?)",
+                        (game_id, self.game_type, self._dumps(self.initial_state()), expires_at.isoformat()),
+                    )
+                    cursor.execute(
+                        "INSERT INTO match_players (player_token, game_id, side, state) VALUES (?, ?, ?, ?)",
+                        (creator_token, game_id, self.first_side, self._dumps(player_state or {})),
+                    )
+                    cursor.execute(
+                        "INSERT INTO match_join_tokens (join_token, game_id) VALUES (?, ?)",
+                        (join_token, game_id),
+                    )
+            except sqlite3.IntegrityError:
+                if attempt == CREATE_ATTEMPTS - 1:
+                    raise
+                continue
+            return game_id, creator_token, join_token
 
     def get_session(self, game_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT game_id, game_type, status, turn_side, state, move_count, created_at, "
-            "expires_at, winner, result_reason FROM match_sessions WHERE game_id = ?",
-            (game_id,),
-        )
-        row = cursor.fetchone()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute(SQL_SELECT_SESSION, (game_id,))
+            row = cursor.fetchone()
 
         if not row:
             return None
@@ -201,15 +310,9 @@ class GameManager:
         }
 
     def get_players(self, game_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT player_token, game_id, side, state, ready, created_at "
-            "FROM match_players WHERE game_id = ? ORDER BY created_at",
-            (game_id,),
-        )
-        rows = cursor.fetchall()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute(SQL_SELECT_PLAYERS, (game_id,))
+            rows = cursor.fetchall()
 
         return [
             {
@@ -223,16 +326,15 @@ class GameManager:
             for r in rows
         ]
 
-    def get_player(self, player_token):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT player_token, game_id, side, state, ready, created_at "
-            "FROM match_players WHERE player_token = ?",
-            (player_token,),
-        )
-        row = cursor.fetchone()
-        conn.close()
+    def get_player(self, player_token, game_id=None):
+        # with a game_id, a token from another game finds nothing, so callers
+        # need no separate "is this player in this game" check
+        with self._cursor() as cursor:
+            if game_id is None:
+                cursor.execute(SQL_SELECT_PLAYER, (player_token,))
+            else:
+                cursor.execute(SQL_SELECT_GAME_PLAYER, (player_token, game_id))
+            row = cursor.fetchone()
 
         if not row:
             return None
@@ -246,14 +348,12 @@ class GameManager:
         }
 
     def validate_join_token(self, join_token):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT game_id, used FROM match_join_tokens WHERE join_token = ?",
-            (join_token,),
-        )
-        row = cursor.fetchone()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute(
+                "SELECT game_id, used FROM match_join_tokens WHERE join_token = ?",
+                (join_token,),
+            )
+            row = cursor.fetchone()
 
         if not row:
             return None, "Invalid invite link"
@@ -269,124 +369,107 @@ class GameManager:
         return game, None
 
     def join_session(self, game_id, join_token):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._transaction() as cursor:
+            # Claim the token only if it is unused and its game still waits;
+            # the checks are part of the UPDATE, so a successful join costs
+            # no SELECT at all.
+            cursor.execute(
+                "UPDATE match_join_tokens SET used = 1 "
+                "WHERE join_token = ? AND game_id = ? AND used = 0 AND EXISTS "
+                "(SELECT 1 FROM match_sessions s "
+                "WHERE s.game_id = match_join_tokens.game_id AND s.status = 'waiting')",
+                (join_token, game_id),
+            )
+            if not cursor.rowcount:
+                return None, self._join_error(cursor, game_id, join_token)
+
+            second_token = make_token()
 
+            cursor.execute(
+                "INSERT INTO match_players (player_token, game_id, side) VALUES (?, ?, ?)",
+                (second_token, game_id, self.second_side),
+            )
+            cursor.execute(
+                "UPDATE match_sessions SET status = ?, turn_side = ? WHERE game_id = ?",
+                (self.status_after_join, self.first_side, game_id),
+            )
+
+        return second_token, None
+
+    @staticmethod
+    def _join_error(cursor, game_id, join_token):
+        # only reached when the claim failed, to tell the player why
         cursor.execute(
             "SELECT used FROM match_join_tokens WHERE join_token = ? AND game_id = ?",
             (join_token, game_id),
         )
         result = cursor.fetchone()
         if not result:
-            conn.close()
-            return None, "Invalid invite link"
+            return "Invalid invite link"
         if result[0]:
-            conn.close()
-            return None, "This invite link has already been used"
-
-        cursor.execute("SELECT status FROM match_sessions WHERE game_id = ?", (game_id,))
-        game = cursor.fetchone()
-        if not game or game[0] != "waiting":
-            conn.close()
-            return None, "This game is no longer available to join"
-
-        second_token = make_token()
-
-        cursor.execute(
-            "UPDATE match_join_tokens SET used = 1 WHERE join_token = ?", (join_token,)
-        )
-        cursor.execute(
-            "INSERT INTO match_players (player_token, game_id, side) VALUES (?, ?, ?)",
-            (second_token, game_id, self.second_side),
-        )
-        cursor.execute(
-            "UPDATE match_sessions SET status = ?, turn_side = ? WHERE game_id = ?",
-            (self.status_after_join, self.first_side, game_id),
-        )
-
-        conn.commit()
-        conn.close()
-        return second_token, None
+            return "This invite link has already been used"
+        return "This game is no longer available to join"
 
     def get_unused_join_token(self, game_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT join_token FROM match_join_tokens WHERE game_id = ? AND used = 0 LIMIT 1",
-            (game_id,),
-        )
-        row = cursor.fetchone()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute(
+                "SELECT join_token FROM match_join_tokens WHERE game_id = ? AND used = 0 LIMIT 1",
+                (game_id,),
+            )
+            row = cursor.fetchone()
         return row[0] if row else None
 
     # ==================== Transitions & events ====================
 
     def set_status(self, game_id, status, winner=None, result_reason=None):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE match_sessions SET status = ?, winner = ?, result_reason = ? WHERE game_id = ?",
-            (status, winner, result_reason, game_id),
-        )
-        conn.commit()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute(
+                "UPDATE match_sessions SET status = ?, winner = ?, result_reason = ? WHERE game_id = ?",
+                (status, winner, result_reason, game_id),
+            )
 
     def set_turn(self, game_id, side):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE match_sessions SET turn_side = ? WHERE game_id = ?",
-            (side, game_id),
-        )
-        conn.commit()
-        conn.close()
-
-    def update_session_state(self, game_id, state):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE match_sessions SET state = ? WHERE game_id = ?",
-            (self._dumps(state), game_id),
-        )
-        conn.commit()
-        conn.close()
-
-    def update_player_state(self, player_token, state, ready=None):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        if ready is None:
+        with self._cursor() as cursor:
             cursor.execute(
-                "UPDATE match_players SET state = ? WHERE player_token = ?",
-                (self._dumps(state), player_token),
+                "UPDATE match_sessions SET turn_side = ? WHERE game_id = ?",
+                (side, game_id),
             )
-        else:
+
+    def update_session_state(self, game_id, state):
+        with self._cursor() as cursor:
             cursor.execute(
-                "UPDATE match_players SET state = ?, ready = ? WHERE player_token = ?",
-                (self._dumps(state), int(ready), player_token),
+                "UPDATE match_sessions SET state = ? WHERE game_id = ?",
+                (self._dumps(state), game_id),
             )
-        conn.commit()
-        conn.close()
+
+    def update_player_state(self, player_token, state, ready=None):
+        with self._cursor() as cursor:
+            if ready is None:
+                cursor.execute(
+                    "UPDATE match_players SET state = ? WHERE player_token = ?",
+                    (self._dumps(state), player_token),
+                )
+            else:
+                cursor.execute(
+                    "UPDATE match_players SET state = ?, ready = ? WHERE player_token = ?",
+                    (self._dumps(state), int(ready), player_token),
+                )
 
     def add_event(self, game_id, side, event_type, data=None):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._cursor() as cursor:
+            self._insert_event(cursor, game_id, side, event_type, data)
+
+    # for callers that log the event inside their own _transaction()
+    def _insert_event(self, cursor, game_id, side, event_type, data=None):
         cursor.execute(
             "INSERT INTO match_events (game_id, side, event_type, data) VALUES (?, ?, ?, ?)",
             (game_id, side, event_type, self._dumps(data or {})),
         )
-        conn.commit()
-        conn.close()
 
     def get_events(self, game_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT id, game_id, side, event_type, data, timestamp "
-            "FROM match_events WHERE game_id = ? ORDER BY id",
-            (game_id,),
-        )
-        rows = cursor.fetchall()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute(SQL_SELECT_EVENTS, (game_id,))
+            rows = cursor.fetchall()
 
         return [
             {
@@ -401,26 +484,25 @@ class GameManager:
         ]
 
     def increment_move_count(self, game_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE match_sessions SET move_count = move_count + 1 WHERE game_id = ?",
-            (game_id,),
-        )
-        conn.commit()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute(
+                "UPDATE match_sessions SET move_count = move_count + 1 WHERE game_id = ?",
+                (game_id,),
+            )
 
     # ==================== Maintenance ====================
 
     def list_games(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT game_id, game_type, status, move_count, created_at, expires_at, winner, result_reason "
-            "FROM match_sessions ORDER BY created_at DESC"
-        )
-        rows = cursor.fetchall()
-        conn.close()
+        with self._cursor() as cursor:
+            # one round trip: the joined sides come back as a comma-separated list
+            # instead of a get_players() query per listed game
+            cursor.execute(
+                "SELECT s.game_id, s.game_type, s.status, s.move_count, s.created_at, s.expires_at, "
+                "s.winner, s.result_reason, GROUP_CONCAT(p.side) "
+                "FROM match_sessions s LEFT JOIN match_players p ON p.game_id = s.game_id "
+                "GROUP BY s.game_id ORDER BY s.created_at DESC"
+            )
+            rows = cursor.fetchall()
 
         games = []
         for row in rows:
@@ -434,23 +516,15 @@ class GameManager:
                 "winner": row[6],
                 "result_reason": row[7],
             }
-            game["players"] = {p["side"]: True for p in self.get_players(row[0])}
+            game["players"] = {side: True for side in (row[8] or "").split(",") if side}
             games.append(game)
         return games
 
     def cleanup_expired(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT game_id FROM match_sessions WHERE expires_at < datetime('now')")
-        expired = [row[0] for row in cursor.fetchall()]
-
-        for game_id in expired:
-            cursor.execute("DELETE FROM match_events WHERE game_id = ?", (game_id,))
-            cursor.execute("DELETE FROM match_players WHERE game_id = ?", (game_id,))
-            cursor.execute("DELETE FROM match_join_tokens WHERE game_id = ?", (game_id,))
-            cursor.execute("DELETE FROM match_sessions WHERE game_id = ?", (game_id,))
-
-        conn.commit()
-        conn.close()
-        return len(expired)
+        # One statement over idx_match_sessions_expires, the cascade takes
+        # the rest. expires_at is stored by isoformat() ("...T..."), so it is
+        # compared against the same format, not SQLite's datetime('now').
+        now = datetime.datetime.utcnow().isoformat()
+        with self._cursor() as cursor:
+            cursor.execute("DELETE FROM match_sessions WHERE expires_at < ?", (now,))
+            return cursor.rowcount
@@ -1,41 +1,85 @@
+import collections
 import datetime
-import sqlite3
+import re
 
 import chess
 
 from core.constants import START_FEN
 from core.game_framework import GameManager
 
+# how many live games keep their parsed chess.Board in memory
+BOARD_CACHE_SIZE = 256
+# how many player tokens keep their (game, color) in memory
+PLAYER_CACHE_SIZE = 1024
+# parsed once; new games start from copies of it
+START_BOARD = chess.Board(START_FEN)
+
+# Anything shaped like a move (SAN in any case, UCI, castling), checked
+# before touching the database. Also keeps null moves ("--", "0000") out.
+MOVE_RE = re.compile(
+    r"(?:[nbrqk]?[a-h]?[1-8]?[x-]?[a-h][1-8](?:=?[nbrq])?|[o0]-[o0](?:-[o0])?)[+#]?",
+    re.IGNORECASE,
+)
+# the longest input MOVE_RE can accept: piece, from-square, capture,
+# to-square, promotion and check, e.g. "Nb1xd2=q+"
+MAX_MOVE_LENGTH = 9
+# plain coordinate moves, which need no SAN disambiguation
+UCI_RE = re.compile(r"[a-h][1-8][a-h][1-8][qrbn]?")
+# a lowercase "b" followed by a rank or a capture is the b-pawn ("b4",
+# "b8=q", "bxc3"); followed by a file it is a bishop ("bb4", "baxc3")
+B_PAWN_RE = re.compile(r"b[1-8x]")
+
 
 class ChessGameManager(GameManager):
     game_type = "chess"
     sides = ("white", "black")
 
+    def __init__(self, *args, **kwargs):
+        # game_id -> (fen, board), least recently played first
+        self._boards = collections.OrderedDict()
+        # player_token -> web player; a token's game and color never change
+        self._players = collections.OrderedDict()
+        super().__init__(*args, **kwargs)
+
     def initial_state(self):
         return {"fen": START_FEN}
 
-    def init_db(self):
-        super().init_db()
-
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def create_schema(self, cursor):
+        super().create_schema(cursor)
 
         # Legacy tables from the pre-framework web and Telegram versions are
-        # dropped. Games live only 24h, so nothing is worth migrating.
+        # dropped. Games live only 24h, so nothing is worth migrating. With
+        # foreign keys on, a parent can't be dropped while rows still point
+        # at it, so the child tables go first.
         for table in (
-            "web_games",
             "web_players",
             "web_moves",
             "web_join_tokens",
-            "games",
+            "web_games",
             "moves",
+            "games",
             "ping_history",
             "active_games",
         ):
             cursor.execute(f"DROP TABLE IF EXISTS {table}")
 
-        conn.commit()
-        conn.close()
+    # ==================== Board cache ====================
+
+    def _take_board(self, game_id, fen):
+        # The cached board is handed out (and dropped from the cache) only if
+        # it still matches the stored position; otherwise parse the FEN.
+        cached = self._boards.pop(game_id, None)
+        if cached and cached[0] == fen:
+            return cached[1]
+        if fen == START_FEN:
+            # every game's first move: copying beats parsing the FEN again
+            return START_BOARD.copy(stack=False)
+        return chess.Board(fen)
+
+    def _keep_board(self, game_id, board, fen):
+        self._boards[game_id] = (fen, board)
+        if len(self._boards) > BOARD_CACHE_SIZE:
+            self._boards.popitem(last=False)
 
     # ==================== Web methods ====================
 
@@ -57,15 +101,32 @@ class ChessGameManager(GameManager):
             "result_reason": game["result_reason"],
         }
 
-    def get_web_player(self, player_token):
-        player = self.get_player(player_token)
-        if not player:
+    def get_web_player(self, player_token, game_id=None):
+        # Every page view of a player resolves the token again, so the
+        # immutable part of the row is kept. A miss is filtered by game in
+        # SQL; a hit is checked against the cached game below. An expired
+        # game is caught by the session lookup the callers do first.
+        with self._lock:
+            web_player = self._players.get(player_token)
+            if web_player:
+                self._players.move_to_end(player_token)
+        if not web_player:
+            player = self.get_player(player_token, game_id)
+            if not player:
+                return None
+            web_player = {
+                "player_token": player["player_token"],
+                "game_id": player["game_id"],
+                "color": player["side"],
+            }
+            with self._lock:
+                self._players[player_token] = web_player
+                if len(self._players) > PLAYER_CACHE_SIZE:
+                    self._players.popitem(last=False)
+
+        if game_id is not None and web_player["game_id"] != game_id:
             return None
-        return {
-            "player_token": player["player_token"],
-            "game_id": player["game_id"],
-            "color": player["side"],
-        }
+        return dict(web_player)
 
     def join_web_game(self, game_id, join_token):
         return self.join_session(game_id, join_token)
@@ -84,52 +145,97 @@ class ChessGameManager(GameManager):
             t = ""
             if start:
                 dt = datetime.datetime.strptime(event["timestamp"], "%Y-%m-%d %H:%M:%S")
-                secs = int((dt - start).total_seconds())
-                h = secs // 3600
-                m = (secs % 3600) // 60
-                s = secs % 60
+                m, s = divmod(int((dt - start).total_seconds()), 60)
+                h, m = divmod(m, 60)
                 t = f"{h}:{m:02d}:{s:02d}"
-            display = uci[:2] + "->" + uci[2:4] if len(uci) >= 4 else san
-            if len(uci) > 4:
-                display += uci[4:]
+            # "e2->e4", promotion suffix included, built in one go
+            display = f"{uci[:2]}->{uci[2:]}" if len(uci) >= 4 else san
             moves.append({"number": i, "time": t, "color": event["side"], "display": display})
 
         return moves
 
     def make_web_move(self, game_id, player_token, move_san):
-        game = self.get_web_game(game_id)
-        if not game:
-            return {"success": False, "error": "Game not found"}
-
-        if game["status"] != "playing":
-            return {"success": False, "error": "Game is not in progress"}
-
-        player = self.get_web_player(player_token)
-        if not player or player["game_id"] != game_id:
-            return {"success": False, "error": "Player not found in this game"}
-
-        board = chess.Board(game["fen"])
-        current_turn_color = "white" if board.turn == chess.WHITE else "black"
-
-        if player["color"] != current_turn_color:
-            return {"success": False, "error": "Not your turn"}
-
-        try:
-            normalized = move_san.lower()
-            if normalized and normalized[0] in "nbrqk":
-                normalized = normalized[0].upper() + normalized[1:]
-            move = board.parse_san(normalized)
-            if not board.is_legal(move):
+        move_san = move_san.strip()
+        if len(move_san) > MAX_MOVE_LENGTH or not MOVE_RE.fullmatch(move_san):
+            return {"success": False, "error": "Invalid move notation"}
+
+        # The read, the turn check and the write share one BEGIN IMMEDIATE:
+        # a single joined SELECT replaces get_web_game() + get_web_player(),
+        # and no other move can slip in between the check and the update.
+        with self._transaction() as cursor:
+            cursor.execute(
+                "SELECT s.status, s.state, p.side FROM match_sessions s "
+                "LEFT JOIN match_players p ON p.game_id = s.game_id AND p.player_token = ? "
+                "WHERE s.game_id = ?",
+                (player_token, game_id),
+            )
+            row = cursor.fetchone()
+            if not row:
+                return {"success": False, "error": "Game not found"}
+
+            status, state, color = row
+            if status != "playing":
+                return {"success": False, "error": "Game is not in progress"}
+
+            if not color:
+                return {"success": False, "error": "Player not found in this game"}
+
+            fen = self._loads(state).get("fen", START_FEN)
+            board = self._take_board(game_id, fen)
+            current_turn_color = "white" if board.turn == chess.WHITE else "black"
+
+            if color != current_turn_color:
+                self._keep_board(game_id, board, fen)
+                return {"success": False, "error": "Not your turn"}
+
+            try:
+                normalized = move_san.lower()
+                if UCI_RE.fullmatch(normalized):
+                    move = chess.Move.from_uci(normalized)
+                    if not board.is_legal(move):
+                        raise chess.IllegalMoveError(normalized)
+                else:
+                    # A leading n/b/r/q/k is read as a piece, except for the
+                    # lowercase b-pawn forms above. parse_san only returns
+                    # legal moves, so there is no second legality check.
+                    if B_PAWN_RE.match(move_san):
+                        try:
+                            move = board.parse_san(normalized)
+                        except ValueError as pawn_error:
+                            # "bxc3" with no b-pawn capture available still
+                            # means the bishop capture, as it always did
+                            if normalized[1] != "x":
+                                raise
+                            try:
+                                move = board.parse_san("B" + normalized[1:])
+                            except ValueError:
+                                raise pawn_error from None
+                    else:
+                        if normalized[0] in "nbrqk":
+                            normalized = normalized[0].upper() + normalized[1:]
+                        elif normalized[0] in "o0":
+                            # parse_san only knows upper-case castling
+                            normalized = normalized.upper().replace("0", "O")
+                        move = board.parse_san(normalized)
+            except chess.IllegalMoveError:
+                self._keep_board(game_id, board, fen)
                 return {"success": False, "error": "Illegal move"}
+            except ValueError as e:
+                self._keep_board(game_id, board, fen)
+                return {"success": False, "error": f"Invalid move notation: {str(e)}"}
 
             move_uci = move.uci()
             board.push(move)
 
-            if board.is_checkmate():
+            # Only the automatic game ends count (no claim_draw): checkmate,
+            # stalemate, insufficient material, the 75-move rule and fivefold
+            # repetition, all worked out by one outcome() call.
+            outcome = board.outcome()
+            if outcome and outcome.termination == chess.Termination.CHECKMATE:
                 game_status = "finished"
-                winner = player["color"]
+                winner = color
                 result_reason = "checkmate"
-            elif board.is_stalemate() or board.is_insufficient_material() or board.can_claim_draw():
+            elif outcome:
                 game_status = "finished"
                 winner = "draw"
                 result_reason = "draw"
@@ -138,41 +244,49 @@ class ChessGameManager(GameManager):
                 winner = None
                 result_reason = None
 
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            new_fen = board.fen()
             cursor.execute(
                 "UPDATE match_sessions SET state = ?, status = ?, winner = ?, result_reason = ?, "
                 "move_count = move_count + 1 WHERE game_id = ?",
-                (self._dumps({"fen": board.fen()}), game_status, winner, result_reason, game_id),
+                (self._dumps({"fen": new_fen}), game_status, winner, result_reason, game_id),
             )
-            conn.commit()
-            conn.close()
-
-            self.add_event(game_id, player["color"], "move", {"san": move_san, "uci": move_uci})
-
-            return {
-                "success": True,
-                "new_fen": board.fen(),
-                "status": game_status,
-                "winner": winner,
-                "result_reason": result_reason,
-            }
+            self._insert_event(cursor, game_id, color, "move", {"san": move_san, "uci": move_uci})
+            self._keep_board(game_id, board, new_fen)
 
-        except ValueError as e:
-            return {"success": False, "error": f"Invalid move notation: {str(e)}"}
+        return {
+            "success": True,
+            "new_fen": new_fen,
+            "status": game_status,
+            "winner": winner,
+            "result_reason": result_reason,
+        }
 
     def resign_web_game(self, game_id, player_token):
-        game = self.get_web_game(game_id)
-        if not game:
-            return {"success": False, "error": "Game not found"}
-        if game["status"] != "playing":
-            return {"success": False, "error": "Game is not in progress"}
+        # same single joined read as make_web_move, and the status check and
+        # the write share a transaction, so a move can't finish the game in
+        # between and have its result overwritten by the resignation
+        with self._transaction() as cursor:
+            cursor.execute(
+                "SELECT s.status, p.side FROM match_sessions s "
+                "LEFT JOIN match_players p ON p.game_id = s.game_id AND p.player_token = ? "
+                "WHERE s.game_id = ?",
+                (player_token, game_id),
+            )
+            row = cursor.fetchone()
+            if not row:
+                return {"success": False, "error": "Game not found"}
 
-        player = self.get_web_player(player_token)
-        if not player or player["game_id"] != game_id:
-            return {"success": False, "error": "Player not found in this game"}
+            status, color = row
+            if status != "playing":
+                return {"success": False, "error": "Game is not in progress"}
+            if not color:
+                return {"success": False, "error": "Player not found in this game"}
 
-        winner = "black" if player["color"] == "white" else "white"
-        self.set_status(game_id, "finished", winner=winner, result_reason="resign")
+            winner = self.opponent(color)
+            cursor.execute(
+                "UPDATE match_sessions SET status = 'finished', winner = ?, "
+                "result_reason = 'resign' WHERE game_id = ?",
+                (winner, game_id),
+            )
 
         return {"success": True, "winner": winner, "result_reason": "resign"}
@@ -1,12 +1,15 @@
 import asyncio
 import datetime
+import functools
 import json
+import logging
 import os
 from urllib.parse import urlencode
 import chess
 import chess.svg
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Form
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
@@ -18,9 +21,13 @@ from configuration import APP_VERSION
 
 LOCALES = {"en", "ru"}
 
+# uvicorn's own error logger is the one configured to print under
+# `uvicorn web.main:app`, so app messages land next to the server's
+logger = logging.getLogger("uvicorn.error")
 
-def _translate(lang: str, key: str, **kwargs: str) -> str:
-    text = TRANSLATIONS.get(lang, {}).get(key, key)
+
+def _translate(messages: dict[str, str], key: str, **kwargs: str) -> str:
+    text = messages.get(key, key)
     if kwargs:
         return text % kwargs
     return text
@@ -120,13 +127,7 @@ TRANSLATIONS: dict[str, dict[str, str]] = {
 
 # English translations are identity (keys are already English)
 for key in TRANSLATIONS["ru"]:
-    if key not in TRANSLATIONS["en"]:
-        TRANSLATIONS["en"][key] = key
-
-# Fill missing English keys as identity
-for key in list(TRANSLATIONS["ru"].keys()):
-    if key not in TRANSLATIONS["en"]:
-        TRANSLATIONS["en"][key] = key
+    TRANSLATIONS["en"].setdefault(key, key)
 
 # Flash-token messages need real English (their key is not English)
 TRANSLATIONS["en"].update({
@@ -137,6 +138,12 @@ TRANSLATIONS["en"].update({
     "gave_up": "You gave up.",
 })
 
+# one ready-made `_` per language, so a page picks it up instead of
+# building a new closure on every request
+TRANSLATORS = {
+    lang: functools.partial(_translate, messages) for lang, messages in TRANSLATIONS.items()
+}
+
 HERE = os.path.dirname(__file__)
 
 gm = ChessGameManager()
@@ -156,7 +163,7 @@ def _common_context(request: Request) -> dict:
     lang = _get_lang(request)
     return {
         "lang": lang,
-        "_": lambda key, **kw: _translate(lang, key, **kw),
+        "_": TRANSLATORS[lang],
         "copyIcon": COPY_ICON_SVG,
         "app_version": APP_VERSION,
     }
@@ -174,25 +181,52 @@ def _time_left(expires_at: str) -> str:
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # every new game opens on the starting position, render it up front
+    _render_svg(chess.STARTING_BOARD_FEN)
     task = asyncio.create_task(_cleanup_loop())
     yield
     task.cancel()
 
+# Routes that touch the database are plain `def`: FastAPI runs them in its
+# thread pool, so a slow SQLite call never stalls the event loop. The
+# managers share their connection across threads behind a lock.
 app = FastAPI(title="GameZZ Web", lifespan=lifespan)
+# A chess page carries its board as an inline SVG of ~20-30 KB of
+# repetitive path data; gzip shrinks it several times over, and the small
+# redirects stay below the threshold.
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 templates = Jinja2Templates(directory=os.path.join(HERE, "templates"))
-app.mount("/static", StaticFiles(directory=os.path.join(HERE, "static")), name="static")
+
+
+class VersionedStaticFiles(StaticFiles):
+    # Templates link assets as ?v=<app_version>, so a release changes the URL
+    # and browsers can keep each file for a long time instead of refetching
+    # (or revalidating) it on every page of every game.
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code == 200:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+
+app.mount("/static", VersionedStaticFiles(directory=os.path.join(HERE, "static")), name="static")
 
 
 async def _cleanup_loop():
     while True:
         await asyncio.sleep(300)
-        deleted = gm.cleanup_expired()
+        deleted = await asyncio.to_thread(gm.cleanup_expired)
         if deleted:
-            print(f"[cleanup] removed {deleted} expired game(s)")
+            logger.info("[cleanup] removed %d expired game(s)", deleted)
 
 
-def _render_svg(fen: str) -> str:
-    board = chess.Board(fen)
+# Every page load of a game re-renders its board; the same position is
+# shown to both players and to spectators, so keep recent renders around.
+# Keyed by the piece placement alone: side to move, castling rights and
+# clocks don't change the picture, and a BaseBoard is all it takes to draw.
+@functools.lru_cache(maxsize=512)
+def _render_svg(board_fen: str) -> str:
+    board = chess.BaseBoard(board_fen)
     return chess.svg.board(board=board, size=400, coordinates=True)
 
 
@@ -211,7 +245,7 @@ async def chess_index(request: Request):
 
 
 @app.post("/games/create")
-async def create_game(request: Request):
+def create_game(request: Request):
     game_id, white_token, join_token = gm.create_web_game()
     return RedirectResponse(
         url=f"/game/{game_id}?player={white_token}",
@@ -230,7 +264,7 @@ async def set_lang(request: Request, lang: str):
 
 
 @app.get("/game/{game_id}", response_class=HTMLResponse)
-async def game_page(request: Request, game_id: str, player: str | None = None):
+def game_page(request: Request, game_id: str, player: str | None = None):
     web_game = gm.get_web_game(game_id)
     if not web_game:
         ctx = _common_context(request)
@@ -242,19 +276,21 @@ async def game_page(request: Request, game_id: str, player: str | None = None):
 
     time_left = _time_left(web_game["expires_at"])
 
-    svg = _render_svg(web_game["fen"])
+    # placement and side to move are the first two FEN fields; the page
+    # needs nothing else from the position, so no chess.Board is parsed
+    placement, turn = web_game["fen"].split(" ", 2)[:2]
+    svg = _render_svg(placement)
     moves = gm.get_web_moves(game_id, web_game["created_at"])
-    web_player = gm.get_web_player(player) if player else None
+    web_player = gm.get_web_player(player, game_id) if player else None
 
     my_color = None
     is_my_turn = False
     share_link = None
     is_creator = False
 
-    if web_player and web_player["game_id"] == game_id:
+    if web_player:
         my_color = web_player["color"]
-        board = chess.Board(web_game["fen"])
-        turn_color = "white" if board.turn == chess.WHITE else "black"
+        turn_color = "white" if turn == "w" else "black"
         is_my_turn = web_game["status"] == "playing" and my_color == turn_color
 
     base_url = str(request.base_url).rstrip("/")
@@ -291,7 +327,7 @@ async def game_page(request: Request, game_id: str, player: str | None = None):
 
 
 @app.get("/game/{game_id}/join", response_class=HTMLResponse)
-async def join_page(request: Request, game_id: str, token: str):
+def join_page(request: Request, game_id: str, token: str):
     game, err = gm.validate_join_token(token)
     ctx = _common_context(request)
     if err:
@@ -302,7 +338,7 @@ async def join_page(request: Request, game_id: str, token: str):
 
 
 @app.post("/game/{game_id}/join")
-async def join_game(request: Request, game_id: str, join_token: str = Form(...)):
+def join_game(request: Request, game_id: str, join_token: str = Form(...)):
     black_token, err = gm.join_web_game(game_id, join_token)
     if err:
         return RedirectResponse(
@@ -316,7 +352,7 @@ async def join_game(request: Request, game_id: str, join_token: str = Form(...))
 
 
 @app.post("/game/{game_id}/resign")
-async def resign_game(
+def resign_game(
     request: Request,
     game_id: str,
     player_token: str = Form(...),
@@ -334,7 +370,7 @@ async def resign_game(
 
 
 @app.get("/admin", response_class=HTMLResponse)
-async def admin_page(request: Request, token: str = ""):
+def admin_page(request: Request, token: str = ""):
     admin_token = os.environ.get("ADMIN_TOKEN")
     if not admin_token or token != admin_token:
         return HTMLResponse("Not Found", status_code=404)
@@ -346,7 +382,7 @@ async def admin_page(request: Request, token: str = ""):
 
 
 @app.post("/game/{game_id}/move")
-async def make_move(
+def make_move(
     request: Request,
     game_id: str,
     player_token: str = Form(...),
@@ -367,6 +403,7 @@ async def make_move(
 # ==================== Battleship ====================
 
 BS_COLS = list(battleship.COLS)
+BS_ROWS = list(range(1, battleship.BOARD_SIZE + 1))
 
 
 def _bs_flash(path: str, **params) -> str:
@@ -377,10 +414,9 @@ def _bs_my_board(player_state: dict) -> list:
     ships = battleship.fleet_cells(player_state.get("fleet", []))
     shots = player_state.get("shots_received", {})
     grid = []
-    for r in range(battleship.BOARD_SIZE):
+    for cells in battleship.GRID:
         row = []
-        for c in range(battleship.BOARD_SIZE):
-            cell = battleship.rc_to_cell(r, c)
+        for cell in cells:
             if cell in shots:
                 cls = "hit" if shots[cell] == "hit" else "miss"
             elif cell in ships:
@@ -395,10 +431,9 @@ def _bs_my_board(player_state: dict) -> list:
 def _bs_enemy_board(player_state: dict, sunk_cells: set) -> list:
     shots = player_state.get("shots_made", {})
     grid = []
-    for r in range(battleship.BOARD_SIZE):
+    for cells in battleship.GRID:
         row = []
-        for c in range(battleship.BOARD_SIZE):
-            cell = battleship.rc_to_cell(r, c)
+        for cell in cells:
             cls = shots.get(cell, "unknown")
             if cls == "hit" and cell in sunk_cells:
                 cls = "sunk"
@@ -407,12 +442,16 @@ def _bs_enemy_board(player_state: dict, sunk_cells: set) -> list:
     return grid
 
 
-def _bs_sunk_cells(events: list) -> set:
+def _bs_shots(events: list) -> tuple[list, set]:
+    # shot log and sunk cells collected in a single pass over the events
+    shot_log = []
     sunk = set()
     for ev in events:
-        if ev["event_type"] == "shot" and ev["data"].get("sunk"):
-            sunk.update(ev["data"]["sunk"])
-    return sunk
+        if ev["event_type"] == "shot":
+            shot_log.append(ev["data"])
+            if ev["data"].get("sunk"):
+                sunk.update(ev["data"]["sunk"])
+    return shot_log, sunk
 
 
 def _bs_fleet_remaining(fleet: list) -> list:
@@ -431,7 +470,7 @@ async def battleship_index(request: Request):
 
 
 @app.post("/battleship/create")
-async def battleship_create(request: Request):
+def battleship_create(request: Request):
     game_id, player_token, _ = bsm.create_battleship_game()
     return RedirectResponse(
         url=f"/battleship/game/{game_id}?player={player_token}",
@@ -440,7 +479,7 @@ async def battleship_create(request: Request):
 
 
 @app.get("/battleship/game/{game_id}", response_class=HTMLResponse)
-async def battleship_game_page(request: Request, game_id: str, player: str | None = None):
+def battleship_game_page(request: Request, game_id: str, player: str | None = None):
     game = bsm.get_battleship_game(game_id)
     if not game:
         ctx = _common_context(request)
@@ -450,11 +489,11 @@ async def battleship_game_page(request: Request, game_id: str, player: str | Non
     msg = request.query_params.get("msg")
     error = request.query_params.get("error")
 
-    player_obj = bsm.get_player(player) if player else None
+    player_obj = bsm.find_player(game, player) if player else None
     my_side = None
     my_state = {}
     my_ready = False
-    if player_obj and player_obj["game_id"] == game_id:
+    if player_obj:
         my_side = player_obj["side"]
         my_state = player_obj["state"]
         my_ready = bool(player_obj["ready"])
@@ -473,17 +512,12 @@ async def battleship_game_page(request: Request, game_id: str, player: str | Non
             if my_side == bsm.first_side:
                 is_creator = True
 
-    events = bsm.get_events(game_id)
-    sunk_cells = _bs_sunk_cells(events)
+    shot_log, sunk_cells = _bs_shots(bsm.get_events(game_id))
 
     board_my = _bs_my_board(my_state) if my_side else None
     board_enemy = _bs_enemy_board(my_state, sunk_cells) if my_side else None
     fleet_remaining = _bs_fleet_remaining(my_state.get("fleet", [])) if my_side else []
 
-    shot_log = [
-        ev["data"] for ev in events if ev["event_type"] == "shot"
-    ]
-
     opp_ready = False
     if my_side:
         opp = next((p for p in game["players"] if p["side"] != my_side), None)
@@ -510,7 +544,7 @@ async def battleship_game_page(request: Request, game_id: str, player: str | Non
         "fleet_remaining": fleet_remaining,
         "shot_log": shot_log,
         "cols": BS_COLS,
-        "rows": list(range(1, 11)),
+        "rows": BS_ROWS,
         "msg": msg,
         "error": error,
     })
@@ -518,7 +552,7 @@ async def battleship_game_page(request: Request, game_id: str, player: str | Non
 
 
 @app.get("/battleship/game/{game_id}/join", response_class=HTMLResponse)
-async def battleship_join_page(request: Request, game_id: str, token: str):
+def battleship_join_page(request: Request, game_id: str, token: str):
     _, err = bsm.validate_join_token(token)
     ctx = _common_context(request)
     if err:
@@ -529,7 +563,7 @@ async def battleship_join_page(request: Request, game_id: str, token: str):
 
 
 @app.post("/battleship/game/{game_id}/join")
-async def battleship_join(request: Request, game_id: str, join_token: str = Form(...)):
+def battleship_join(request: Request, game_id: str, join_token: str = Form(...)):
     token, err = bsm.join_session(game_id, join_token)
     if err:
         return RedirectResponse(
@@ -543,7 +577,7 @@ async def battleship_join(request: Request, game_id: str, join_token: str = Form
 
 
 @app.post("/battleship/game/{game_id}/lock")
-async def battleship_lock(
+def battleship_lock(
     request: Request,
     game_id: str,
     player_token: str = Form(...),
@@ -570,7 +604,7 @@ async def battleship_lock(
 
 
 @app.post("/battleship/game/{game_id}/shoot")
-async def battleship_shoot(
+def battleship_shoot(
     request: Request,
     game_id: str,
     player_token: str = Form(...),
@@ -593,7 +627,7 @@ async def battleship_shoot(
 
 
 @app.post("/battleship/game/{game_id}/resign")
-async def battleship_resign(
+def battleship_resign(
     request: Request,
     game_id: str,
     player_token: str = Form(...),